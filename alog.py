@@ -26,27 +26,41 @@ def main():
     uids = set()
 
     if args.package:
-        packages_raw = subprocess.check_output([
-            'adb',
-            *args.adb_arg,
-            'shell',
-            'pm', 'list', 'packages', '-U',
-        ])
-        package_to_uid = {}
-
-        for line in packages_raw.splitlines():
-            package, delim, uid = line.decode('ascii').partition(' ')
-            if not delim:
-                raise ValueError(f'Bad line: {line!r}')
-
-            package_to_uid[package.removeprefix('package:')] = \
-                uid.removeprefix('uid:')
-
-        for package in args.package:
-            if package in package_to_uid:
-                uids.add(package_to_uid[package])
-            else:
-                raise ValueError(f'Invalid package: {package}')
+        wanted = set(args.package)
+
+        with subprocess.Popen(
+            [
+                'adb',
+                *args.adb_arg,
+                'shell',
+                'pm', 'list', 'packages', '-U',
+            ],
+            stdout=subprocess.PIPE,
+            encoding='ascii',
+        ) as process:
+            for line in process.stdout:
+                package, delim, uid = line.rstrip('\n').partition(' ')
+                if not delim:
+                    raise ValueError(f'Bad line: {line!r}')
+
+                package = package.removeprefix('package:')
+                if package in wanted:
+                    uids.add(uid.removeprefix('uid:'))
+                    wanted.remove(package)
+
+                    # No need to wait for the rest of the package list.
+                    if not wanted:
+                        process.terminate()
+                        break
+
+        if wanted:
+            if process.returncode:
+                raise subprocess.CalledProcessError(process.returncode,
+                                                    process.args)
+
+            for package in args.package:
+                if package in wanted:
+                    raise ValueError(f'Invalid package: {package}')
 
     subprocess.check_call([
         'adb',
@@ -5,6 +5,7 @@ import os
 import re
 import subprocess
 
+import orjson
 import requests
 
 
@@ -12,6 +13,9 @@ BEATSAVER_HEADERS = {
     'User-Agent': 'convert-beat-saber-obs-recording/0.0 (https://github.com/chenxiaolong/random-scripts/blob/master/convert-beat-saber-obs-recording.py)',
 }
 
+SESSION = requests.Session()
+SESSION.headers.update(BEATSAVER_HEADERS)
+
 RE_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
 RE_HOUR = re.compile(r'^\d{2}$')
 RE_BSR_ID = re.compile(r'^[0-9a-fA-F]+$')
@@ -41,20 +45,23 @@ RE_RANK = re.compile(r'^([A-F]|S{1,3})$')
 #   - SL - Static Lights
 RE_MODIFIER = re.compile(r'^([14]L|DA|FS|GN|LH|N[ABFW]|PM|S([ALNS]|FS)|ZM)$')
 RE_OBS_FILENAME = re.compile(r'^(\d{4}-\d{2}-\d{2})\s*-?\s*(\d{2})')
-RE_TRIMMABLE = re.compile(r'^(?:\(.*\)|\[.*\]|\{.*\}|【.*】)$')
 
+# Opening bracket -> closing bracket for names that are entirely wrapped
+TRIMMABLE_BRACKETS = {
+    '(': ')',
+    '[': ']',
+    '{': '}',
+    '【': '】',
+}
 
-def valid_on_win_fs(c):
-    return c not in ('<', '>', ':', '"', '/', '\\', '|', '?', '*') \
-        and ord(c) >= 32
+# Characters that are not valid in filenames on Windows filesystems
+WIN_FS_REPLACEMENTS = str.maketrans(
+    dict.fromkeys([*'<>:"/\\|?*', *map(chr, range(32))], '_'))
 
 
 def same_file(path1, path2):
     try:
-        stat1 = os.stat(path1)
-        stat2 = os.stat(path2)
-
-        return stat1.st_dev == stat2.st_dev and stat1.st_ino == stat2.st_ino
+        return os.path.samefile(path1, path2)
     except FileNotFoundError:
         return False
 
@@ -63,12 +70,8 @@ def trim_name(s):
     if s:
         s = s.strip()
 
-        while True:
-            m = RE_TRIMMABLE.match(s)
-            if m:
-                s = s[1:-1].strip()
-            else:
-                break
+        while s and TRIMMABLE_BRACKETS.get(s[0]) == s[-1]:
+            s = s[1:-1].strip()
 
     return s
 
@@ -190,11 +193,10 @@ def main():
             raise Exception('Date or time not provided and could not be determined from input filename')
 
         if args.bsr_id:
-            r = requests.get(f'https://beatsaver.com/api/maps/id/{args.bsr_id}',
-                             headers=BEATSAVER_HEADERS)
+            r = SESSION.get(f'https://beatsaver.com/api/maps/id/{args.bsr_id}')
             r.raise_for_status()
 
-            data = r.json()
+            data = orjson.loads(r.content)
 
             args.song = trim_name(data['metadata']['songName'])
             sub_name = trim_name(data['metadata']['songSubName'])
@@ -204,22 +206,6 @@ def main():
             args.artist = trim_name(data['metadata']['songAuthorName'])
             args.mapper = trim_name(data['metadata']['levelAuthorName'])
 
-        components = [args.date, args.time]
-
-        artist_components = []
-        if args.artist:
-            artist_components.append(args.artist)
-        if args.mapper:
-            artist_components.append(f'[{args.mapper}]')
-        if artist_components:
-            components.append(' '.join(artist_components))
-
-        components.append(args.song)
-        components.append(args.difficulty)
-
-        if args.modifier:
-            components.append(', '.join(sorted(args.modifier)))
-
         if args.misses < 0:
             misses = 'Failed'
         elif args.misses == 0 and not args.no_fc:
@@ -229,14 +215,23 @@ def main():
         else:
             misses = f'{args.misses} misses'
 
-        components.append(misses)
-        components.append(args.rank)
-
-        if args.comment:
-            components.append(args.comment)
-
-        filename = ' - '.join(components)
-        args.output = ''.join(c if valid_on_win_fs(c) else '_' for c in filename) + '.mkv'
+        mapper = f'[{args.mapper}]' if args.mapper else None
+        artist = ' '.join(c for c in (args.artist, mapper) if c)
+
+        components = [
+            args.date,
+            args.time,
+            artist or None,
+            args.song,
+            args.difficulty,
+            ', '.join(sorted(args.modifier)) if args.modifier else None,
+            misses,
+            args.rank,
+            args.comment or None,
+        ]
+
+        filename = ' - '.join(c for c in components if c is not None)
+        args.output = filename.translate(WIN_FS_REPLACEMENTS) + '.mkv'
 
     if same_file(args.input, args.output):
         raise Exception('Input and output paths are the same')
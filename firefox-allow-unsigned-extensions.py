@@ -2,13 +2,21 @@
 
 import argparse
 import contextlib
+import copy
 import os
-import re
-import shutil
+import struct
 import tempfile
 import zipfile
 
 
+# Signature, skipped fields, file name length, extra field length
+LOCAL_HEADER_FORMAT = '<4s22xHH'
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_FORMAT)
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+FLAG_DATA_DESCRIPTOR = 1 << 3
+COPY_BUF_SIZE = 1 << 20
+
+
 @contextlib.contextmanager
 def open_output_file(path):
     directory = os.path.dirname(path)
@@ -22,6 +30,67 @@ def open_output_file(path):
             raise
 
 
+# Copy a member's compressed data verbatim to avoid decompressing and
+# recompressing files that don't need to be modified.
+def copy_raw_member(z_in, z_out, info):
+    # The central directory doesn't record the size of the local header's
+    # extra field, so it must be read from the local header itself.
+    z_in.fp.seek(info.header_offset)
+    signature, name_len, extra_len = \
+        struct.unpack(LOCAL_HEADER_FORMAT, z_in.fp.read(LOCAL_HEADER_SIZE))
+    if signature != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f'Bad local header: {info.filename}')
+
+    z_in.fp.seek(name_len + extra_len, os.SEEK_CUR)
+
+    new_info = copy.copy(info)
+    # The sizes and CRC are known up front, so they are always written to the
+    # local header instead of a trailing data descriptor.
+    new_info.flag_bits &= ~FLAG_DATA_DESCRIPTOR
+
+    z_out.fp.seek(z_out.start_dir)
+    new_info.header_offset = z_out.fp.tell()
+    z_out.fp.write(new_info.FileHeader())
+
+    remaining = info.compress_size
+    while remaining:
+        chunk = z_in.fp.read(min(remaining, COPY_BUF_SIZE))
+        if not chunk:
+            raise EOFError(f'Truncated data: {info.filename}')
+
+        z_out.fp.write(chunk)
+        remaining -= len(chunk)
+
+    z_out.start_dir = z_out.fp.tell()
+    z_out.filelist.append(new_info)
+    z_out.NameToInfo[new_info.filename] = new_info
+
+
+def disable_require_signing(data):
+    marker = b'MOZ_REQUIRE_SIGNING:'
+    chunks = []
+    start = 0
+    index = 0
+
+    while (index := data.find(marker, index)) >= 0:
+        index += len(marker)
+        while data[index:index + 1].isspace():
+            index += 1
+
+        if data.startswith(b'true', index):
+            chunks.append(data[start:index])
+            chunks.append(b'false')
+            index += len(b'true')
+            start = index
+
+    if not chunks:
+        raise ValueError('MOZ_REQUIRE_SIGNING did not change')
+
+    chunks.append(data[start:])
+
+    return b''.join(chunks)
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('input', help='Path to omni.ja')
@@ -45,27 +114,16 @@ def main():
         zipfile.ZipFile(fz_out, 'w') as z_out,
     ):
         for info in z_in.infolist():
-            with (
-                z_in.open(info, 'r') as f_in,
-                z_out.open(info, 'w') as f_out,
-            ):
-                if os.path.basename(info.filename).startswith('AppConstants.'):
-                    found_app_constants = True
-                    data = f_in.read()
-
-                    new_data = re.sub(
-                        b'(MOZ_REQUIRE_SIGNING:\\s*)true',
-                        b'\\1false',
-                        data,
-                    )
-
-                    if new_data == data:
-                        raise ValueError('MOZ_REQUIRE_SIGNING did not change')
-
-                    f_out.write(new_data)
-
-                else:
-                    shutil.copyfileobj(f_in, f_out)
+            if os.path.basename(info.filename).startswith('AppConstants.'):
+                found_app_constants = True
+
+                with (
+                    z_in.open(info, 'r') as f_in,
+                    z_out.open(info, 'w') as f_out,
+                ):
+                    f_out.write(disable_require_signing(f_in.read()))
+            else:
+                copy_raw_member(z_in, z_out, info)
 
     if not found_app_constants:
         raise ValueError('AppConstants file not found')
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
+
+import orjson
 import requests
 
 
@@ -10,14 +13,15 @@ class JellyfinClient:
         self.username = username
         self.api_key = api_key
 
+        self._session = requests.Session()
+        self._session.headers['Authorization'] = \
+            f'MediaBrowser Token="{self.api_key}"'
+
         self.user_id = self.get_user_by_name(self.username)['Id']
 
     def _request(self, method, path, *args, **kwargs):
-        kwargs.setdefault('headers', {}) \
-            .setdefault('Authorization',
-                        f'MediaBrowser Token="{self.api_key}"')
-
-        return requests.request(method, self.base_url + path, *args, **kwargs)
+        return self._session.request(method, self.base_url + path, *args,
+                                     **kwargs)
 
     def _get(self, path, *args, **kwargs):
         return self._request('get', path, *args, **kwargs)
@@ -29,50 +33,25 @@ class JellyfinClient:
         r = self._get('/Users')
         r.raise_for_status()
 
-        data = r.json()
+        data = orjson.loads(r.content)
         for user in data:
             if user['Name'] == name:
                 return user
 
         raise ValueError(f'User {name} not found')
 
-    def get_series(self):
+    def get_all_episodes(self):
         r = self._get(
             f'/Users/{self.user_id}/Items',
             params={
-                'IncludeItemTypes': 'Series',
+                'IncludeItemTypes': 'Episode',
                 'Recursive': 'true',
-            },
-        )
-        r.raise_for_status()
-
-        data = r.json()
-        return data['Items']
-
-    def get_seasons(self, series_id):
-        r = self._get(
-            f'/Shows/{series_id}/Seasons',
-            params={
-                'userId': self.user_id,
-            },
-        )
-        r.raise_for_status()
-
-        data = r.json()
-        return data['Items']
-
-    def get_episodes(self, series_id, season_id):
-        r = self._get(
-            f'/Shows/{series_id}/Episodes',
-            params={
-                'seasonId': season_id,
-                'userId': self.user_id,
                 'fields': 'ProviderIds',
             },
         )
         r.raise_for_status()
 
-        data = r.json()
+        data = orjson.loads(r.content)
         return data['Items']
 
     def merge_episodes(self, episode_ids):
@@ -102,24 +81,26 @@ def main():
 
     client = JellyfinClient(args.base_url, args.username, args.api_key)
 
-    for series in client.get_series():
-        for season in client.get_seasons(series['Id']):
-            groups = {}
+    groups = collections.defaultdict(list)
+
+    for episode in client.get_all_episodes():
+        group_key = (
+            episode['SeriesName'],
+            episode['SeasonName'],
+            episode['Name'],
+            *sorted(episode['ProviderIds'].items()),
+        )
 
-            for episode in client.get_episodes(series['Id'], season['Id']):
-                group_key = (
-                    episode['SeriesName'],
-                    episode['SeasonName'],
-                    episode['Name'],
-                    *tuple(sorted(episode['ProviderIds'].items())),
-                )
+        # Only merge within the same season of the same series, even if
+        # another series happens to have the same name.
+        season_key = (episode['SeriesId'], episode['SeasonId'])
 
-                groups.setdefault(group_key, []).append(episode['Id'])
+        groups[(season_key, group_key)].append(episode['Id'])
 
-            for group_key, episode_ids in groups.items():
-                if len(episode_ids) > 1:
-                    print('Merging:', group_key, '->', episode_ids)
-                    client.merge_episodes(episode_ids)
+    for (_, group_key), episode_ids in groups.items():
+        if len(episode_ids) > 1:
+            print('Merging:', group_key, '->', episode_ids)
+            client.merge_episodes(episode_ids)
 
 
 if __name__ == '__main__':
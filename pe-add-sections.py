@@ -39,6 +39,10 @@
 # specified sections is not supported.
 
 import argparse
+import io
+import os
+import shutil
+import stat
 
 import pefile
 
@@ -50,6 +54,38 @@ def align_to(value, page_size):
     return (value + page_size - 1) // page_size * page_size
 
 
+def same_file(path1, path2):
+    try:
+        return os.path.samefile(path1, path2)
+    except FileNotFoundError:
+        return False
+
+
+def read_file(path: str) -> bytes:
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+
+    try:
+        # Regular files are read in a single syscall by stopping once the size
+        # reported by fstat() has been read instead of reading again to hit
+        # EOF. Anything else, like a pipe, is read until EOF.
+        st = os.fstat(fd)
+        is_regular = stat.S_ISREG(st.st_mode)
+        size = max(st.st_size, io.DEFAULT_BUFFER_SIZE)
+        chunks = []
+        total = 0
+
+        while chunk := os.read(fd, size):
+            chunks.append(chunk)
+            total += len(chunk)
+
+            if is_regular and total >= st.st_size:
+                break
+
+        return b''.join(chunks)
+    finally:
+        os.close(fd)
+
+
 # Mostly based on systemd's ukify logic
 def pe_add_sections(input: str, output: str, sections: dict[str, bytes]):
     pe = pefile.PE(input, fast_load=True)
@@ -68,12 +104,29 @@ def pe_add_sections(input: str, output: str, sections: dict[str, bytes]):
         pe.OPTIONAL_HEADER.SizeOfHeaders,
         pe.OPTIONAL_HEADER.FileAlignment,
     )
-    pe = pefile.PE(data=pe.write(), fast_load=True)
 
-    warnings = pe.get_warnings()
+    # Instead of reparsing the whole file, check for the problems that growing
+    # the headers could introduce on top of the warnings from the first parse.
+    warnings = list(pe.get_warnings())
+
+    if pe.OPTIONAL_HEADER.AddressOfEntryPoint \
+            < pe.OPTIONAL_HEADER.SizeOfHeaders:
+        warnings.append('Entry point is within the headers')
+
+    for s in pe.sections:
+        if s.SizeOfRawData and \
+                s.PointerToRawData < pe.OPTIONAL_HEADER.SizeOfHeaders:
+            warnings.append(f'Section {s.Name!r} overlaps the headers')
+
     if warnings:
         raise Exception(f'Warnings when adjusting size of headers: {warnings}')
 
+    # pefile maps the input file instead of reading it into memory. To avoid
+    # copying the entire image just to write it back out, only the headers and
+    # the new section data are written to the output file.
+    file_size = len(pe.__data__)
+    section_data = []
+
     for name, data in sections.items():
         new_section = pefile.SectionStructure(
             pe.__IMAGE_SECTION_HEADER_format__, pe=pe)
@@ -88,7 +141,7 @@ def pe_add_sections(input: str, output: str, sections: dict[str, bytes]):
         new_section.Misc_VirtualSize = len(data)
         # Start at previous EOF + padding for alignment
         new_section.PointerToRawData = align_to(
-            len(pe.__data__),
+            file_size,
             pe.OPTIONAL_HEADER.FileAlignment,
         )
         new_section.SizeOfRawData = align_to(
@@ -107,10 +160,8 @@ def pe_add_sections(input: str, output: str, sections: dict[str, bytes]):
         # - Padding from previous EOF to new aligned section
         # - New section data
         # - Padding from end of section to EOF
-        pe.__data__ = pe.__data__[:] \
-            + bytes(new_section.PointerToRawData - len(pe.__data__)) \
-            + data \
-            + bytes(new_section.SizeOfRawData - len(data))
+        section_data.append((new_section.PointerToRawData, data))
+        file_size = new_section.PointerToRawData + new_section.SizeOfRawData
 
         pe.FILE_HEADER.NumberOfSections += 1
         pe.OPTIONAL_HEADER.SizeOfInitializedData += \
@@ -124,7 +175,31 @@ def pe_add_sections(input: str, output: str, sections: dict[str, bytes]):
         pe.OPTIONAL_HEADER.SectionAlignment,
     )
 
-    pe.write(output)
+    # Same as pe.write(), except limited to the headers
+    headers = bytearray(pe.__data__[:pe.OPTIONAL_HEADER.SizeOfHeaders])
+
+    for structure in pe.__structures__:
+        struct_data = structure.__pack__()
+        offset = structure.get_file_offset()
+        if offset + len(struct_data) > len(headers):
+            raise Exception(f'Structure outside of headers: {structure.name}')
+
+        headers[offset:offset + len(struct_data)] = struct_data
+
+    pe.close()
+
+    if not same_file(input, output):
+        shutil.copyfile(input, output)
+
+    with open(output, 'r+b') as f:
+        f.write(headers)
+
+        # Seeking past EOF and truncating fills the padding with zeros.
+        for offset, data in section_data:
+            f.seek(offset)
+            f.write(data)
+
+        f.truncate(file_size)
 
 
 class UniqueKeyValuePairAction(argparse.Action):
@@ -181,9 +256,7 @@ def parse_args():
     args.null_terminate = set(args.null_terminate)
 
     for name in args.section.keys() | args.null_terminate:
-        try:
-            name.encode('ascii')
-        except UnicodeEncodeError:
+        if not name.isascii():
             parser.error(f'Section name must be ASCII only: {name!r}')
 
     missing = args.null_terminate - args.section.keys()
@@ -199,8 +272,7 @@ def main():
     sections = {}
 
     for name, path in args.section.items():
-        with open(path, 'rb') as f:
-            data = f.read()
+        data = read_file(path)
 
         if name in args.null_terminate:
             data += b'\0'
@@ -4,45 +4,172 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
 import argparse
+import concurrent.futures
 import functools
+import json
+import os
 import pathlib
+import re
+import tempfile
+import typing
 
 import requests
+import requests.adapters
 import ruamel.yaml
 import ruamel.yaml.comments
 
 
+MAX_WORKERS = 16
+
+SESSION = requests.Session()
+SESSION.mount(
+    'https://',
+    requests.adapters.HTTPAdapter(pool_maxsize=MAX_WORKERS),
+)
+
+CACHE_PATH = pathlib.Path(
+    os.environ.get('XDG_CACHE_HOME') or pathlib.Path.home() / '.cache',
+    'update-github-actions.json',
+)
+
+# Block-style `uses:` keys, which is how they're written in practice
+RE_USES = re.compile(
+    r'''^[ \t]*(?:-[ \t]+)?uses:[ \t]*(['"]?)([^\s'"#]+)\1[ \t]*(?:#.*)?$''',
+    re.M,
+)
+# Anything that might be a `uses:` key outside of a comment, including quoted
+# keys and keys in flow mappings
+RE_USES_ANY = re.compile(r'''^[^#\n]*\buses['"]?\s*:''', re.M)
+# Values that are known to be action references. Anything else, like YAML
+# anchors, aliases, tags, or block scalars, can't be handled by the scan.
+RE_ACTION_REF = re.compile(
+    r'^(?:[\w.-]+/[\w.-]+(?:/[^\s@]+)*@[^\s@]+|\./\S*|docker://\S+)$')
+
+# URL -> (ETag, response body)
+HTTP_CACHE: dict[str, tuple[str, str]] = {}
+
+
+def load_http_cache():
+    # The cache is only an optimization, so start from scratch if it's missing
+    # or malformed.
+    try:
+        with open(CACHE_PATH, 'r') as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return
+
+    if not isinstance(data, dict):
+        return
+
+    for url, entry in data.items():
+        if isinstance(entry, list) and len(entry) == 2 \
+                and all(isinstance(e, str) for e in entry):
+            HTTP_CACHE[url] = (entry[0], entry[1])
+
+
+def save_http_cache():
+    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile(
+        'w',
+        dir=CACHE_PATH.parent,
+        delete=False,
+    ) as f:
+        try:
+            json.dump(HTTP_CACHE, f)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+
+    os.replace(f.name, CACHE_PATH)
+
+
+def cached_get(url: str, headers: dict[str, str] | None = None) -> str:
+    headers = dict(headers or {})
+
+    # Conditional requests that return 304 don't count against the rate limit.
+    cached = HTTP_CACHE.get(url)
+    if cached:
+        headers['If-None-Match'] = cached[0]
+
+    r = SESSION.get(url, headers=headers)
+    if cached and r.status_code == 304:
+        return cached[1]
+
+    r.raise_for_status()
+
+    if etag := r.headers.get('ETag'):
+        HTTP_CACHE[url] = (etag, r.text)
+
+    return r.text
+
+
 @functools.cache
 def get_latest_tag(repo_path: str) -> tuple[str, str]:
-    r = requests.get(f'https://api.github.com/repos/{repo_path}/releases/latest')
-    r.raise_for_status()
+    data = cached_get(
+        f'https://api.github.com/repos/{repo_path}/releases/latest')
 
-    tag_name = r.json()['tag_name']
+    tag_name = json.loads(data)['tag_name']
 
-    r = requests.get(
+    commit = cached_get(
         f'https://api.github.com/repos/{repo_path}/commits/refs/tags/{tag_name}',
         headers={'Accept': 'application/vnd.github.sha'},
     )
 
-    commit = r.text
-
     return (tag_name, commit)
 
 
-def update_step(step: ruamel.yaml.comments.CommentedMap) -> bool:
-    if 'uses' not in step:
-        return False
+def prefetch_latest_tags(repo_paths: typing.Iterable[str]):
+    # The API requests are by far the slowest part, so perform them all in
+    # parallel up front. The results are cached by get_latest_tag(). Errors are
+    # ignored here because the repos come from a best-effort scan. Exceptions
+    # are not cached, so they are raised again if the repo is actually used.
+    def prefetch(repo_path):
+        try:
+            get_latest_tag(repo_path)
+        except Exception:
+            pass
+
+    with concurrent.futures.ThreadPoolExecutor(MAX_WORKERS) as executor:
+        for _ in executor.map(prefetch, repo_paths):
+            pass
 
-    uses = step['uses']
 
+def parse_uses(uses: str) -> tuple[str, str] | None:
     action_path, delim, _ = uses.partition('@')
     if not delim:
         # This is a path to a local action.
-        return False
+        return None
 
     # Everything after the second slash is a directory path.
     repo_path = '/'.join(action_path.split('/')[:2])
 
+    return (action_path, repo_path)
+
+
+def is_latest(uses: str) -> bool:
+    action = parse_uses(uses)
+    if action is None:
+        return True
+
+    action_path, repo_path = action
+    _, commit = get_latest_tag(repo_path)
+
+    return uses == f'{action_path}@{commit}'
+
+
+def update_step(step: ruamel.yaml.comments.CommentedMap) -> bool:
+    if 'uses' not in step:
+        return False
+
+    uses = step['uses']
+
+    action = parse_uses(uses)
+    if action is None:
+        return False
+
+    action_path, repo_path = action
+
     tag, commit = get_latest_tag(repo_path)
 
     new_uses = f'{action_path}@{commit}'
@@ -68,31 +195,61 @@ def update_step(step: ruamel.yaml.comments.CommentedMap) -> bool:
     return True
 
 
-def update_yaml(path: pathlib.Path):
-    print(f'Updating: {path}')
+# Find all `uses:` values without parsing the YAML. The boolean is False if
+# there might be `uses:` keys that the scan couldn't extract.
+def scan_uses(path: pathlib.Path) -> tuple[list[str], bool]:
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    uses = [u for (_, u) in RE_USES.findall(text) if RE_ACTION_REF.match(u)]
+    complete = len(uses) == len(RE_USES_ANY.findall(text))
+
+    return (uses, complete)
+
+
+def is_up_to_date(scan: tuple[list[str], bool]) -> bool:
+    uses, complete = scan
+    if not uses or not complete:
+        return False
+
+    try:
+        return all(is_latest(u) for u in uses)
+    except Exception:
+        # Let the normal code path report the error if the value is real.
+        return False
+
 
+def load_yaml(path: pathlib.Path) -> tuple[ruamel.yaml.YAML, typing.Any]:
     yaml = ruamel.yaml.YAML(typ='rt')
     yaml.preserve_quotes = True
 
-    with open(path, 'r+b') as f:
+    with open(path, 'rb') as f:
         data = yaml.load(f)
 
-        changed = False
+    return (yaml, data)
+
+
+def get_steps(path: pathlib.Path, data: typing.Any) \
+        -> list[ruamel.yaml.comments.CommentedMap]:
+    if 'runs' in data:
+        return list(data['runs']['steps'])
+    elif 'jobs' in data:
+        return [step for (_, job_data) in data['jobs'].items()
+                for step in job_data['steps']]
+    else:
+        raise ValueError(f'Steps not found: {path}')
+
 
-        if 'runs' in data:
-            for step in data['runs']['steps']:
-                changed = changed | update_step(step)
-        elif 'jobs' in data:
-            for (_, job_data) in data['jobs'].items():
-                for step in job_data['steps']:
-                    changed = changed | update_step(step)
-        else:
-            raise ValueError(f'Steps not found: {path}')
+def update_yaml(path: pathlib.Path, yaml: ruamel.yaml.YAML, data: typing.Any):
+    print(f'Updating: {path}')
+
+    changed = False
 
-        if changed:
-            f.seek(0)
-            f.truncate(0)
+    for step in get_steps(path, data):
+        changed = changed | update_step(step)
 
+    if changed:
+        with open(path, 'wb') as f:
             yaml.width = 2 ** 16
             yaml.indent(mapping=2, sequence=4, offset=2)
             yaml.dump(data, f)
@@ -108,8 +265,29 @@ def parse_args():
 def main():
     args = parse_args()
 
-    for file in args.file:
-        update_yaml(file)
+    scans = {file: scan_uses(file) for file in args.file}
+
+    repo_paths = set()
+    for (uses, _) in scans.values():
+        for u in uses:
+            if (action := parse_uses(u)) is not None:
+                repo_paths.add(action[1])
+
+    load_http_cache()
+
+    try:
+        prefetch_latest_tags(repo_paths)
+
+        for file in args.file:
+            # Avoid the expensive round trip through ruamel when there's
+            # nothing to change.
+            if is_up_to_date(scans[file]):
+                print(f'Up to date: {file}')
+                continue
+
+            update_yaml(file, *load_yaml(file))
+    finally:
+        save_http_cache()
 
 
 if __name__ == '__main__':